@@ -18,6 +18,10 @@ projects.
 Filename must contain list of absolute paths to Git repositories you
 with to read, one per line.  Comments using '#' are understood.
 
+Results are cached per repository and period in
+~/.cache/git-log-multi-all and reused until the repository's refs
+change.  Use --no-cache to bypass.
+
 INSTALL
 
     source $VIRTUALENV
@@ -30,8 +34,16 @@ EXAMPLES
 """
 
 import calendar
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date,datetime
+import hashlib
 import os
+from operator import attrgetter
+import pickle
+import re
+import subprocess
+import tempfile
 
 from blessings import Terminal
 import click
@@ -40,20 +52,34 @@ from dateutil import parser
 
 TERM = Terminal()
 
-TEMPLATE = '{ts} ' \
-           '{t.yellow}{commit}{t.normal} ' \
-           '{t.green}({author}){t.normal} ' \
-           '{t.yellow}{repo}{t.normal} ' \
-           '{t.red}[{branch}]{t.normal} ' \
-           '{subject}'
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'git-log-multi-all')
+CACHE_SIZE = 100  # max cached (repo, period) entries
+CACHE_VERSION = 2  # bump when repo_log rows change
+
+# %-style for speed; fields are hms, commit, author, repo, branch, subject
+TEMPLATE = '%s ' \
+           '{t.yellow}%s{t.normal} ' \
+           '{t.green}(%s){t.normal} ' \
+           '{t.yellow}%s{t.normal} ' \
+           '{t.red}[%s]{t.normal} ' \
+           '%s'
+
+# hash, %ct, committer, %D refs, subject
+LOG_LINE_RE = re.compile(r'^([0-9a-f]+)\0(\d+)\0([^\0]*)\0([^\0]*)\0(.*)$')
+
+Commit = namedtuple('Commit', 'repo commit ts author branch subject day hms')
+
+# Commit fields in TEMPLATE order
+TEMPLATE_FIELDS = attrgetter('hms', 'commit', 'author', 'repo', 'branch', 'subject')
 
 
 @click.command()
 @click.option('-s','--start', help='Start date (ex: "2017-05-01")')
 @click.option('-e','--end',   help='End date (ex: "2017-05-31")')
 @click.option('-m','--month', help='Month (ex: "2017-05")')
+@click.option('-n','--no-cache', is_flag=True, help='Do not read or write cached results')
 @click.argument('filename')
-def main(start, end, month, filename):
+def main(start, end, month, no_cache, filename):
     """
     filename: Filename containing list of abs paths to repositories.
     """
@@ -66,32 +92,39 @@ def main(start, end, month, filename):
     click.echo('  end: %s' % end)
     click.echo('')
     
-    commits_by_date = {}
+    commits_by_date = defaultdict(list)
     
     click.echo('Reading list...')
     REPOS = get_repos_list(filename)
     
     click.echo('Gathering data...')
-    for path in REPOS:
-        click.echo(path)
-        repo = get_repo(path)
-        commits = repo_commits(repo, start, end)
-        commits_by_date = assign_to_date(commits, commits_by_date)
+    # git log runs in a subprocess so threads are enough to overlap them.
+    # Results are collected here in the main thread, which is the only
+    # one touching commits_by_date.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {
+            executor.submit(gather_commits, path, start, end, not no_cache): path
+            for path in REPOS
+        }
+        for future in as_completed(futures):
+            click.echo(futures[future])
+            commits_by_date = assign_to_date(future.result(), commits_by_date)
     click.echo('')
 
-    dates = sorted(commits_by_date.keys())
+    dates = sorted(commits_by_date)
 
+    template = bake_template(TEMPLATE, TERM)
     for d in dates:
         commits = commits_by_date[d]
-        print_day(d, commits, TEMPLATE)
+        print_day(d, commits, template)
 
 
 def get_repos_list(filename):
     with open(filename, 'r') as f:
         return [
-            line
-            for line in f.read().splitlines()
-            if not (line.find('#') == 0)
+            line.strip()
+            for line in f
+            if line.strip() and not line.lstrip().startswith('#')
         ]
 
 def get_start_end(start=None, end=None, month=None):
@@ -104,7 +137,7 @@ def get_start_end(start=None, end=None, month=None):
         start = parser.parse(start)
         end = parser.parse(end)
     elif month:
-        start = parser.parse(month)
+        start = datetime.strptime(month, '%Y-%m')
         end = date(
             start.year,
             start.month,
@@ -115,75 +148,187 @@ def get_start_end(start=None, end=None, month=None):
 def get_repo(path):
     return git.Repo(path)
 
-def repo_commits(repo, since, until):
+def gather_commits(path, since, until, cache=True):
+    return repo_commits(get_repo(path), since, until, cache)
+
+def log_window(since, until):
+    """Explicit local times for git log --since/--until
+    
+    Bare dates would be resolved using the current time of day.
+    
+    @param since: datetime
+    @param until: datetime
+    @returns: (str, str)
+    """
+    return (
+        since.strftime('%Y-%m-%d 00:00:00'),
+        until.strftime('%Y-%m-%d 23:59:59'),
+    )
+
+def repo_refs_hash(repo):
+    """Hash of HEAD and every ref; changes whenever `git log --all` could
     """
+    refs = subprocess.run(
+        ['git', '-C', repo.working_dir, 'show-ref', '--head'],
+        capture_output=True, encoding='utf-8', errors='replace',
+    ).stdout
+    return hashlib.sha1(refs.encode()).hexdigest()
+
+def cached_repo_log(repo, since, until):
+    """repo_log, with results pickled to CACHE_DIR
+    
+    Rows hold epoch seconds rather than local times so they can be
+    reused in any timezone.  git reads the window in local time, so the
+    key includes its epoch bounds.
+    
     @param repo: git.Repo
-    @param start: datetime
-    @param end: datetime
+    @param since: datetime
+    @param until: datetime
+    """
+    window = log_window(since, until)
+    key = hashlib.sha1('|'.join([
+        str(CACHE_VERSION),
+        repo.working_dir,
+        repo_refs_hash(repo),
+    ] + [
+        '%s@%d' % (t, datetime.strptime(t, '%Y-%m-%d %H:%M:%S').timestamp())
+        for t in window
+    ]).encode()).hexdigest()
+    path = os.path.join(CACHE_DIR, '%s.pickle' % key)
+    try:
+        os.utime(path)  # mark as recently used
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, ValueError, pickle.UnpicklingError):
+        pass  # not cached, trimmed by another worker, or unreadable
+    rows = repo_log(repo, since, until)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # unique per writer; workers may share a key (and always share a pid)
+    fd,tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(rows, f)
+    os.replace(tmp, path)
+    trim_cache(CACHE_DIR, CACHE_SIZE)
+    return rows
+
+def trim_cache(cache_dir, size):
+    """Remove least recently used entries beyond size
+    """
+    def mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            return 0
+    paths = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir)
+        if name.endswith('.pickle')
+    ]
+    paths.sort(key=mtime, reverse=True)
+    for path in paths[size:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # already trimmed by another worker
+
+def repo_commits(repo, since, until, cache=False):
+    """
+    @param repo: git.Repo
+    @param since: datetime
+    @param until: datetime
+    @param cache: bool Use cached_repo_log
+    @returns: list of Commit
     """
     repo_name = os.path.basename(repo.working_dir)
-    # git log --all --since=2017-05-01 --until=2017-05-31 --no-merges --pretty=format:"%h|%ci|%ce|%d|%s" --reverse
-    raw = repo.git.log(
+    if cache:
+        rows = cached_repo_log(repo, since, until)
+    else:
+        rows = repo_log(repo, since, until)
+    commits = []
+    for commit,epoch,email,branch,subject in rows:
+        ts = datetime.fromtimestamp(epoch)
+        commits.append(Commit(
+            repo_name, commit, ts, email, branch, subject,
+            ts.date(), ts.strftime('%H:%M:%S'),
+        ))
+    return commits
+
+def repo_log(repo, since, until):
+    """Commits on all branches from git log
+    
+    @param repo: git.Repo
+    @param since: datetime
+    @param until: datetime
+    @returns: list of (commit, epoch, committer, branch, subject)
+    """
+    # Call git directly rather than through GitPython's command wrapper,
+    # and parse its output as it streams in.
+    # Fields are NUL-separated so subjects may contain any printable char.
+    # git log --all --since="2017-05-01 00:00:00" --until="2017-05-31 23:59:59" --no-merges --pretty=format:"%h%x00%ct%x00%cn%x00%D%x00%s"
+    since,until = log_window(since, until)
+    cmd = [
+        'git', '-C', repo.working_dir, 'log',
         '--all',
         '--no-merges',
-        '--since=%s' % since.strftime('%Y-%m-%d'),
-        '--until=%s' % until.strftime('%Y-%m-%d'),
-        '--pretty=format:"%h|%ci|%cn|%d|%s"',
-    )
-    commits = []
+        '--since=%s' % since,
+        '--until=%s' % until,
+        '--pretty=format:%h%x00%ct%x00%cn%x00%D%x00%s',
+    ]
+    rows = []
     branch = ''
-    for line in raw.splitlines():
-        commit,rawdate,email,refname,subject = line.strip().replace('"','').split('|')
-        # branch in every commit
-        if refname:
-            # strip out parens, keep only final branch name
-            branch = refname.strip().replace('(','').replace(')','') # .split(',')[-1].strip()
-        ts = parser.parse(rawdate)
-        commits.append({
-            'repo': repo_name,
-            'commit': commit,
-            'date': rawdate,
-            'ts': ts,
-            'author': email,
-            'branch': branch,
-            'subject': subject
-        })
-    sorted(commits, key=lambda commit: commit['ts'])
-    commits.reverse()
-    return commits
+    # Read bytes so only \n ends a record; subjects may contain a bare \r.
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, bufsize=1<<16
+    ) as proc:
+        for raw in proc.stdout:
+            line = raw.decode('utf-8', 'replace')
+            match = LOG_LINE_RE.match(line)
+            if not match:
+                raise ValueError('Unexpected git log line: %r' % line)
+            commit,rawdate,email,refname,subject = match.groups()
+            # branch in every commit
+            if refname:
+                branch = refname
+            rows.append((commit, int(rawdate), email, branch, subject))
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return rows
 
 def assign_to_date(commits, dates):
     """Add each commit to a list according to date
     
-    @param commits: list of commit dicts
-    @param dates: dict of commit dicts by date '%Y-%m-%d'
+    @param commits: list of Commit
+    @param dates: defaultdict(list) of Commit lists by datetime.date
     @returns: dict of lists by dates
     """
     for commit in commits:
-        d = commit['ts'].strftime('%Y-%m-%d')
-        if not dates.get(d):
-            dates[d] = []
-        dates[d].append(commit)
+        dates[commit.day].append(commit)
     return dates
 
+def bake_template(template, term):
+    """Fill in terminal color codes so they aren't looked up per commit
+
+    Colors are dropped entirely when output is not a terminal.
+    
+    @param template: str containing {t.COLOR} placeholders
+    @param term: blessings.Terminal
+    @returns: str with only %s commit field placeholders left
+    """
+    for color in ['yellow', 'green', 'red', 'normal']:
+        code = getattr(term, color) if term.is_a_tty else ''
+        template = template.replace('{t.%s}' % color, code)
+    return template
+
 def print_commits(commits, template):
-    """Print list of commits
+    """Print list of commits, newest first
     """
-    sorted(commits, key=lambda commit: commit['ts'])
-    commits.reverse()
-    for c in commits:
-        click.echo(template.format(
-            t=TERM,
-            commit=c['commit'],
-            ts=c['ts'].strftime('%H:%M:%S'),
-            repo=c['repo'],
-            branch=c['branch'],
-            author=c['author'],
-            subject=c['subject'],
-        ))
+    commits.sort(key=attrgetter('ts'), reverse=True)
+    click.echo('\n'.join(
+        template % TEMPLATE_FIELDS(c)
+        for c in commits
+    ))
 
-def print_day(dstr, commits, template):
-    day = parser.parse(dstr)
+def print_day(day, commits, template):
     click.echo('------------------------------------------------------------------------')
     click.echo(day.strftime('%Y-%m-%d %A'))
     print_commits(commits, template)